@@ -1,27 +1,77 @@
 import os
+import asyncio
 import json
+import hashlib
 import logging
-import re
-from fastapi import FastAPI
-from fastapi.responses import JSONResponse
+import time
+from collections import OrderedDict, deque
+import httpx
+import orjson
+from fastapi import BackgroundTasks, FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, LengthFinishReasonError, OpenAIError
 
 # Load environment variables
 load_dotenv()
-logging.basicConfig(level=logging.INFO)
+# Guarded so a reload doesn't reinstall handlers, and ops can quiet per-request
+# INFO logging (token telemetry) in prod via LOG_LEVEL
+if not logging.getLogger().handlers:
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
 
 # API Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 CEREBRAS_API_KEY = os.getenv("CEREBRAS_API_KEY")
 
-openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+# A 100KB paste becomes ~25k billed input tokens; cap questions well before that
+MAX_INPUT_CHARS = 8000
+# Ceiling on each perspective embedded in the audit prompt — backstop for the
+# max_tokens caps, since audit cost/latency scale linearly with prompt length
+MAX_PERSPECTIVE_CHARS = 4000
+# One batch submission is bounded too — the Batch API is cheap, not free
+MAX_BATCH_QUESTIONS = 100
+
+# Hard wall-clock cap per provider call so a stuck provider can't pin a worker
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "15"))
+# Overall budget for one /audit request (two pipeline stages plus slack);
+# bounds p99 regardless of how the stage timeouts compose
+OVERALL_BUDGET_SECONDS = float(os.getenv("OVERALL_BUDGET_SECONDS", "40"))
+
+# Per-provider concurrency caps: N concurrent audits otherwise multiply into
+# unbounded outbound calls, tripping provider rate limits into 429+retry loops
+OPENAI_SEM = asyncio.Semaphore(int(os.getenv("OPENAI_CONCURRENCY", "8")))
+CEREBRAS_SEM = asyncio.Semaphore(int(os.getenv("CEREBRAS_CONCURRENCY", "8")))
+
+# Model ids referenced on the hot path
+OPENAI_MODEL = "gpt-4o-mini"
+CEREBRAS_MODEL = "llama3.3-70b"
+
+# Output-token ceilings: an unbounded completion can run to the model max,
+# blowing both the latency budget and the bill
+MAX_ANSWER_TOKENS = 512
+MAX_AUDIT_TOKENS = 1024  # fused call carries the answer plus the audit JSON
+MAX_AUDIT_TOKENS_RETRY = 4096  # headroom for the one retry after a truncation
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+# One tuned HTTP/2 connection pool shared by both providers: keep-alive
+# connections skip TCP/TLS handshakes and the pool size bounds concurrency
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+    timeout=httpx.Timeout(60.0, connect=5.0),
+    http2=True,
+)
+
+# Module-level async clients so the underlying connection pool is reused across requests
+openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client, max_retries=LLM_MAX_RETRIES) if OPENAI_API_KEY else None
 # Cerebras uses the OpenAI SDK structure but with a different base URL
-cerebras_client = OpenAI(base_url="https://api.cerebras.ai/v1", api_key=CEREBRAS_API_KEY) if CEREBRAS_API_KEY else None
+cerebras_client = AsyncOpenAI(base_url="https://api.cerebras.ai/v1", api_key=CEREBRAS_API_KEY, http_client=http_client, max_retries=LLM_MAX_RETRIES) if CEREBRAS_API_KEY else None
 
-app = FastAPI(title="AuditTrail Unified Core")
+# orjson (Rust) handles both the audit-JSON decode and the response encode
+app = FastAPI(title="AuditTrail Unified Core", default_response_class=ORJSONResponse)
 
 # CORS: Allow frontend to communicate
 app.add_middleware(
@@ -32,91 +82,574 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Reports are repetitive text that gzips to a fraction of their size
+app.add_middleware(GZipMiddleware, minimum_size=500)
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await http_client.aclose()
+
 # 1. Define Input Model
 class AuditRequest(BaseModel):
     question: str
 
+class BatchAuditRequest(BaseModel):
+    questions: list[str]
+
+# Schema enforced on the auditor via structured outputs: the SDK hands back a
+# parsed model (no second json.loads) and every key the formatter reads is
+# guaranteed to exist. Claims are a list of name/confidence pairs — strict
+# mode rejects open-ended maps (additionalProperties must be false), so a
+# dict[str, str] field here would 400 on every call.
+class Claim(BaseModel):
+    name: str
+    confidence: str
+
+class AuditData(BaseModel):
+    answer: str
+    consensus_score: int
+    claims: list[Claim]
+    uncertainties: list[str]
+    risks: list[str]
+    severity: list[str]
+    comparison: str
+
 # Auditor Prompt
+# NOTE: This block is fully static and is always sent FIRST, before the dynamic
+# question/answers, so OpenAI's automatic prompt-prefix cache can reuse it across
+# requests (cached input tokens are discounted and prefill is skipped).
 COMBINED_AUDIT_PROMPT = """
 You are a senior auditor. Analyze the user query and the model perspectives.
-Return a STRICT JSON object:
+
+If the OpenAI Perspective is marked N/A, first answer the user query yourself
+and treat your own answer as the OpenAI Perspective for the audit below.
+
+YOUR TASK:
+1. Extract every distinct factual or reasoning claim made in the perspectives.
+2. Rate the confidence of each claim as "high", "medium" or "low".
+3. List what is uncertain or missing from the perspectives.
+4. List reasoning risks and possible biases in how the answers were produced.
+5. List severity-based warnings the user should see before acting.
+6. Compare the perspectives and summarize where they agree and disagree.
+7. Produce a single consensus score for the overall answer.
+
+SCORING RUBRIC for consensus_score (0-100):
+- 90-100: Both perspectives agree on all material claims; claims are verifiable,
+  mainstream and low-risk; no meaningful uncertainty remains.
+- 75-89: Perspectives agree on the core answer but differ on details, emphasis
+  or completeness; remaining uncertainty would not change the user's decision.
+- 50-74: Perspectives partially agree; at least one material claim is unverified,
+  time-sensitive or disputed; the user should verify before relying on it.
+- 25-49: Perspectives conflict on a material claim, or only one perspective is
+  available and it contains weakly supported claims.
+- 0-24: Perspectives directly contradict each other on the core answer, or the
+  answer is speculative, unverifiable or potentially harmful if wrong.
+If only one perspective is available (the other is "N/A"), cap the score at 74.
+
+CLAIM CONFIDENCE LEVELS:
+- "high": established fact, consistent across perspectives, unlikely to change.
+- "medium": plausible and mostly supported, but depends on context, recency or
+  interpretation.
+- "low": speculative, contested, hallucination-prone, or stated by only one
+  perspective without support.
+
+SEVERITY WARNINGS: include an entry whenever the query touches medical, legal,
+financial or safety-critical decisions, or when acting on a wrong answer would
+be costly or irreversible. Phrase each warning as a single actionable sentence.
+
+OUTPUT CONTRACT — return a STRICT JSON object, no prose, no markdown fences:
 {
+  "answer": "string",
   "consensus_score": 0-100,
-  "claims": {"claim_name": "high/medium/low"},
+  "claims": [{"name": "claim_name", "confidence": "high/medium/low"}],
   "uncertainties": ["list"],
   "risks": ["list"],
   "severity": ["list"],
   "comparison": "summary"
 }
+Keys must appear exactly as shown. "answer" is the answer you produced when
+the OpenAI Perspective was N/A, otherwise an empty string. Each "claims" entry
+pairs a short snake_case name (e.g. "capital_of_france") with a confidence
+level. Lists may be empty but must be present. "comparison" is 1-3 sentences
+of plain text.
+
+WORKED EXAMPLE (follow this shape exactly):
+
+Input:
+User Query: Can I take ibuprofen and paracetamol together?
+
+OpenAI Perspective: Yes, ibuprofen and paracetamol can generally be taken
+together by healthy adults, as they work through different mechanisms.
+Standard advice is to stay within the daily limit for each drug and to space
+doses. People with kidney problems, stomach ulcers or on blood thinners
+should check with a doctor first.
+
+Cerebras Perspective: Taking both is common and usually safe for short-term
+pain relief in adults. Paracetamol is processed by the liver and ibuprofen
+affects the stomach and kidneys, so the risks do not stack. Do not exceed the
+maximum daily dose of either, and avoid ibuprofen on an empty stomach.
+
+Output:
+{
+  "answer": "",
+  "consensus_score": 86,
+  "claims": [
+    {"name": "combined_use_generally_safe_for_healthy_adults", "confidence": "high"},
+    {"name": "different_mechanisms_of_action", "confidence": "high"},
+    {"name": "daily_dose_limits_apply_to_each_drug", "confidence": "high"},
+    {"name": "caution_with_kidney_liver_stomach_conditions", "confidence": "medium"}
+  ],
+  "uncertainties": [
+    "Neither perspective states the specific maximum daily doses.",
+    "No guidance for children, pregnancy or long-term use."
+  ],
+  "risks": [
+    "Both answers assume a healthy adult without checking the user's situation.",
+    "Dosage guidance varies by country and formulation."
+  ],
+  "severity": [
+    "Medical decision: confirm dosing with a pharmacist or doctor, especially with existing conditions or other medications."
+  ],
+  "comparison": "Both perspectives agree the combination is generally safe for
+healthy adults within dose limits. They emphasise different organ risks but do
+not contradict each other on any material claim."
+}
+
+Note how the example scores 86: the perspectives agree on the core answer and
+all material claims, but dosing specifics are missing, which keeps it out of
+the 90-100 band. Note also that the medical severity warning is present even
+though the answers agree — severity reflects the stakes of acting on a wrong
+answer, not disagreement between perspectives.
 """
 
+# Static report scaffolding, built once at import rather than per request
+REPORT_DISCLAIMER = "DISCLAIMER: This report is a cross-model mathematical audit. Consult professionals for final decisions."
+
+# %-style template for the audit sections: the layout is parsed once at import
+# and rendering is a single C-level substitution per request
+AUDIT_SECTIONS_TMPL = (
+    "AUDITTRAIL UNIFIED REPORT\n"
+    "Combined Consensus Confidence: %s%%\n\n"
+    "• Confidence per Claim:\n"
+    "%s\n"
+    "• Uncertainties & Missing Information:\n%s\n\n"
+    "• Reasoning Risks & Possible Biases:\n%s\n\n"
+    "• Severity-Based Warnings:\n%s\n\n"
+    "• Alternative Perspective (Comparison):\n%s\n\n"
+) + REPORT_DISCLAIMER
+
+# An N/A OpenAI Perspective tells the auditor to answer the query itself
+# (fused answer+audit — one completion instead of two)
+AUDIT_INPUT_TMPL = "User Query: %s\n\nOpenAI Perspective: %s\n\nCerebras Perspective: %s"
+
+# In-process response cache: a repeated question returns the stored report in
+# microseconds instead of re-paying the OpenAI round-trip and tokens.
+CACHE_MAX_SIZE = 1024
+CACHE_TTL_SECONDS = 3600
+_response_cache = OrderedDict()
+
+def cache_get(key):
+    entry = _response_cache.get(key)
+    if not entry:
+        return None
+    expires_at, value = entry
+    if time.time() > expires_at:
+        del _response_cache[key]
+        return None
+    _response_cache.move_to_end(key)
+    return value
+
+def cache_put(key, value):
+    _response_cache[key] = (time.time() + CACHE_TTL_SECONDS, value)
+    _response_cache.move_to_end(key)
+    while len(_response_cache) > CACHE_MAX_SIZE:
+        _response_cache.popitem(last=False)
+
+# Semantic layer on top of the exact-match cache: paraphrased duplicates
+# ("capital of France?" vs "France's capital?") hit on embedding similarity.
+# OpenAI embeddings are unit-norm, so cosine similarity is a plain dot product;
+# the candidate set is small enough that a linear scan beats pulling in FAISS.
+EMBED_MODEL = "text-embedding-3-small"
+SEMANTIC_CACHE_MAX = 256
+SEMANTIC_SIM_THRESHOLD = 0.92
+_semantic_cache = []  # (expires_at, embedding, result)
+
+async def embed_question(question):
+    if not openai_client:
+        return None
+    try:
+        async with OPENAI_SEM:
+            resp = await asyncio.wait_for(
+                openai_client.embeddings.create(model=EMBED_MODEL, input=question),
+                timeout=LLM_TIMEOUT_SECONDS,
+            )
+        return resp.data[0].embedding
+    except (OpenAIError, httpx.HTTPError, TimeoutError) as e:
+        logger.warning(f"Embedding Error: {e}")
+        return None
+
+def semantic_cache_get(embedding):
+    now = time.time()
+    _semantic_cache[:] = [entry for entry in _semantic_cache if entry[0] > now]
+    best = None
+    best_sim = SEMANTIC_SIM_THRESHOLD
+    for _, vec, result in _semantic_cache:
+        sim = sum(a * b for a, b in zip(embedding, vec))
+        if sim >= best_sim:
+            best_sim = sim
+            best = result
+    return best
+
+def semantic_cache_put(embedding, result):
+    _semantic_cache.append((time.time() + CACHE_TTL_SECONDS, embedding, result))
+    while len(_semantic_cache) > SEMANTIC_CACHE_MAX:
+        _semantic_cache.pop(0)
+
+# Rolling window of (cached, prompt) token counts so ops can see whether the
+# OpenAI prompt-prefix cache is actually hitting
+_prompt_cache_samples = deque(maxlen=1000)
+
+def log_audit_event(question, cache_hit, duration):
+    # Runs as a BackgroundTask after the response is sent, so log handler
+    # latency (stdout flushes on Render) never sits on the request path
+    logger.info("audit question_chars=%d cache_hit=%s duration=%.2fs", len(question), cache_hit, duration)
+
+def record_usage(usage):
+    cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", 0) or 0
+    _prompt_cache_samples.append((cached, usage.prompt_tokens))
+    logger.info("tokens prompt=%d cached=%d completion=%d", usage.prompt_tokens, cached, usage.completion_tokens)
+
 def clean_json(text):
-    text = re.sub(r"```json\s*|```\s*", "", text)
-    return text.strip()
+    # Two literal fences, no pattern features needed — str.replace beats the
+    # regex engine and this was the last re usage in the module
+    return text.replace("```json", "").replace("```", "").strip()
+
+def parse_audit_json(text):
+    # Fast path: one orjson parse. Fallback: raw_decode stops at the end of
+    # the first complete object, so trailing prose can't break the parse and
+    # there is no rfind scan for a closing brace.
+    text = clean_json(text)
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        start = text.find("{")
+        if start == -1:
+            raise
+        data, _ = json.JSONDecoder().raw_decode(text[start:])
+        return data
 
-# FIX: Removed 'async' to prevent blocking the event loop with sync client
-def get_model_data(client, model_id, question):
+# FIX: Truly async now — AsyncOpenAI awaits the network call instead of blocking the event loop
+async def get_model_data(client, model_id, question):
     if not client: return None
+    sem = OPENAI_SEM if client is openai_client else CEREBRAS_SEM
     try:
-        resp = client.chat.completions.create(
-            model=model_id, 
-            messages=[{"role": "user", "content": question}]
-        )
+        async with sem:
+            resp = await asyncio.wait_for(
+                client.chat.completions.create(
+                    model=model_id,
+                    messages=[{"role": "user", "content": question}],
+                    max_tokens=MAX_ANSWER_TOKENS
+                ),
+                timeout=LLM_TIMEOUT_SECONDS,
+            )
         return resp.choices[0].message.content
-    except Exception as e:
-        logging.error(f"Model Error ({model_id}): {e}")
+    except (OpenAIError, httpx.HTTPError, TimeoutError) as e:
+        # Expected upstream failures degrade to the N/A path; anything else
+        # (including cancellation on client disconnect) propagates
+        logger.warning(f"Model Error ({model_id}): {e}")
         return None
 
-# 2. Endpoint uses JSON input/output
-# FIX: Removed 'async' (and 'await') to allow FastAPI to handle threading automatically
-@app.post("/audit", response_class=JSONResponse)
-def process_request(request: AuditRequest):
-    question = request.question
-    
-    # Generate Primary Answer (OpenAI)
-    primary_answer = get_model_data(openai_client, "gpt-4o-mini", question)
-    
-    # Get Second Perspective (Cerebras)
-    cerebras_perspective = get_model_data(cerebras_client, "llama3.3-70b", question)
-
-    if not primary_answer:
+def clip_perspective(text):
+    if text and len(text) > MAX_PERSPECTIVE_CHARS:
+        logger.info("perspective truncated from %d chars", len(text))
+        return text[:MAX_PERSPECTIVE_CHARS]
+    return text
+
+async def audit_completion(audit_input, max_tokens):
+    async with OPENAI_SEM:
+        return await asyncio.wait_for(
+            openai_client.chat.completions.parse(
+                model=OPENAI_MODEL,
+                messages=[
+                    {"role": "system", "content": COMBINED_AUDIT_PROMPT},
+                    {"role": "user", "content": audit_input}
+                ],
+                response_format=AuditData,
+                max_tokens=max_tokens,
+                temperature=0  # deterministic audits keep the response cache semantically sound
+            ),
+            timeout=LLM_TIMEOUT_SECONDS,
+        )
+
+async def run_audit(question, primary_answer, cerebras_perspective):
+    audit_input = AUDIT_INPUT_TMPL % (
+        question,
+        clip_perspective(primary_answer) or 'N/A',
+        clip_perspective(cerebras_perspective) or 'N/A',
+    )
+    try:
+        audit_resp = await audit_completion(audit_input, MAX_AUDIT_TOKENS)
+    except LengthFinishReasonError:
+        # A long-but-valid fused answer can overflow the default cap; one
+        # retry with headroom beats failing the whole request
+        logger.warning("audit truncated at %d tokens; retrying with %d", MAX_AUDIT_TOKENS, MAX_AUDIT_TOKENS_RETRY)
+        audit_resp = await audit_completion(audit_input, MAX_AUDIT_TOKENS_RETRY)
+    if audit_resp.usage:
+        record_usage(audit_resp.usage)
+    msg = audit_resp.choices[0].message  # one descriptor walk, reused below
+    if msg.parsed is None:
+        # Refusal: degrade to a minimal zero-confidence report rather than 500
+        logger.warning("auditor refused: %s", msg.refusal)
+        return {
+            "answer": "",
+            "consensus_score": 0,
+            "claims": [],
+            "uncertainties": [],
+            "risks": [],
+            "severity": [msg.refusal or "The auditor declined to audit this query."],
+            "comparison": "No comparison available.",
+        }
+    return msg.parsed.model_dump()
+
+def dedup(items):
+    # Order-preserving dedup with an O(1) set membership check; also drops
+    # empty entries the model sometimes emits
+    seen = set()
+    out = []
+    for item in items:
+        if item and item not in seen:
+            seen.add(item)
+            out.append(item)
+    return out
+
+def format_claims(claims):
+    # Structured output gives a list of name/confidence pairs; the json_object
+    # batch path may still hand back the older map form, so accept both
+    if isinstance(claims, dict):
+        return "".join(f"{name}: {level}\n" for name, level in claims.items())
+    return "".join(f"{claim.get('name', '?')}: {claim.get('confidence', '?')}\n" for claim in claims or [])
+
+def format_audit_sections(data):
+    # Each field is read from the dict exactly once; the dynamic list blocks
+    # are joined and dropped into the precompiled layout in a single pass
+    return AUDIT_SECTIONS_TMPL % (
+        data.get('consensus_score', 0),
+        format_claims(data.get('claims', [])),
+        "\n".join(f"- {i}" for i in dedup(data.get('uncertainties', []))),
+        "\n".join(f"- {i}" for i in dedup(data.get('risks', []))),
+        "\n".join(f"- {i}" for i in dedup(data.get('severity', []))),
+        data.get('comparison', 'No comparison available.'),
+    )
+
+# Concurrent identical questions piggyback on one pipeline run instead of
+# each dispatching their own fan-out
+_inflight = {}
+
+async def audit_pipeline(question, cache_key):
+    if not openai_client:
         return {"report": "ERROR: Primary AI (OpenAI) failed to respond. Check API Keys."}
 
-    # Generate Unified Audit
-    audit_input = f"User Query: {question}\n\nOpenAI Perspective: {primary_answer}\n\nCerebras Perspective: {cerebras_perspective or 'N/A'}"
-    
-    data = {}
+    # The question embedding (for the semantic cache) and the Cerebras
+    # perspective are independent — overlap them
+    embedding, cerebras_perspective = await asyncio.gather(
+        embed_question(question),
+        get_model_data(cerebras_client, CEREBRAS_MODEL, question),
+    )
+    if embedding:
+        cached = semantic_cache_get(embedding)
+        if cached:
+            cache_put(cache_key, cached)  # promote to the exact-match cache too
+            return cached
+
+    # One fused OpenAI call that both answers the query and audits
     try:
-        audit_resp = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": COMBINED_AUDIT_PROMPT},
-                {"role": "user", "content": audit_input}
-            ],
-            response_format={"type": "json_object"}
-        )
-        data = json.loads(clean_json(audit_resp.choices[0].message.content))
-    except Exception as e:
-        return {"report": f"AUDIT FAILURE: {str(e)}"}
+        data = await run_audit(question, None, cerebras_perspective)
+    except Exception:
+        # One call captures the full traceback; clients get a clean 500
+        # instead of a report body with internals pasted into it
+        logger.exception("audit failed")
+        raise HTTPException(status_code=500, detail="Audit failed")
+
+    primary_answer = data.get("answer") or "N/A"
 
     # 3. Format Output Text
-    output = "ANSWER BY AI\n"
-    output += f"{primary_answer}\n\n"
-    
-    output += "AUDITTRAIL UNIFIED REPORT\n"
-    output += f"Combined Consensus Confidence: {data.get('consensus_score', 0)}%\n\n"
-    
-    output += "• Confidence per Claim:\n"
-    claims = data.get('claims', {})
-    for claim, level in claims.items():
-        output += f"{claim}: {level}\n"
-    
-    output += f"\n• Uncertainties & Missing Information:\n" + "\n".join([f"- {i}" for i in data.get('uncertainties', [])])
-    output += f"\n\n• Reasoning Risks & Possible Biases:\n" + "\n".join([f"- {i}" for i in data.get('risks', [])])
-    output += f"\n\n• Severity-Based Warnings:\n" + "\n".join([f"- {i}" for i in data.get('severity', [])])
-    output += f"\n\n• Alternative Perspective (Comparison):\n{data.get('comparison', 'No comparison available.')}\n\n"
-    
-    output += "DISCLAIMER: This report is a cross-model mathematical audit. Consult professionals for final decisions."
-    
-    # 4. Return JSON Object
-    return {"report": output}
\ No newline at end of file
+    output = f"ANSWER BY AI\n{primary_answer}\n\n" + format_audit_sections(data)
+
+    # 4. Return JSON Object (and remember it for repeat submissions)
+    result = {"report": output}
+    cache_put(cache_key, result)
+    if embedding:
+        semantic_cache_put(embedding, result)
+    return result
+
+# 2. Endpoint uses JSON input/output
+# FIX: async def + awaited client calls let one worker handle many in-flight audits
+@app.post("/audit", response_class=ORJSONResponse)
+async def process_request(request: AuditRequest, background: BackgroundTasks):
+    question = request.question.strip()
+    if len(question) > MAX_INPUT_CHARS:
+        raise HTTPException(status_code=413, detail="Input too large")
+
+    # Cache hit: identical question against the same model set + prompt
+    cache_key = hashlib.sha256(f"{OPENAI_MODEL}|{CEREBRAS_MODEL}|{COMBINED_AUDIT_PROMPT}|{question}".encode()).hexdigest()
+    cached = cache_get(cache_key)
+    if cached:
+        background.add_task(log_audit_event, question, True, 0.0)
+        return cached
+
+    # In-flight dedup: join an identical audit that is already running
+    started = time.time()
+    task = _inflight.get(cache_key)
+    if task is None:
+        task = asyncio.create_task(audit_pipeline(question, cache_key))
+        _inflight[cache_key] = task
+        task.add_done_callback(lambda _t, key=cache_key: _inflight.pop(key, None))
+    # shield: a waiter hitting its budget must not cancel the shared task,
+    # which other waiters may still be on and which can still fill the cache
+    try:
+        result = await asyncio.wait_for(asyncio.shield(task), timeout=OVERALL_BUDGET_SECONDS)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Audit timed out")
+    background.add_task(log_audit_event, question, False, time.time() - started)
+    return result
+
+# Streaming variant: forwards answer tokens as OpenAI produces them, then the
+# audit sections once the auditor returns — first byte in hundreds of ms
+# instead of waiting out the full pipeline. The JSON /audit contract is unchanged.
+@app.post("/audit/stream")
+async def process_request_stream(request: AuditRequest):
+    question = request.question.strip()
+    if len(question) > MAX_INPUT_CHARS:
+        raise HTTPException(status_code=413, detail="Input too large")
+
+    async def generate():
+        if not openai_client:
+            yield "ERROR: Primary AI (OpenAI) failed to respond. Check API Keys."
+            return
+
+        # Second perspective runs in the background while the answer streams
+        perspective_task = asyncio.create_task(get_model_data(cerebras_client, CEREBRAS_MODEL, question))
+
+        yield "ANSWER BY AI\n"
+        answer_parts = []
+        try:
+            async with OPENAI_SEM:
+                stream = await openai_client.chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=[{"role": "user", "content": question}],
+                    max_tokens=MAX_ANSWER_TOKENS,
+                    stream=True
+                )
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content or ""
+                if delta:
+                    answer_parts.append(delta)
+                    yield delta
+        except Exception as e:
+            logger.error(f"Model Error ({OPENAI_MODEL}): {e}")
+            perspective_task.cancel()
+            yield "\nERROR: Primary AI (OpenAI) failed to respond. Check API Keys."
+            return
+
+        primary_answer = "".join(answer_parts)
+        cerebras_perspective = await perspective_task
+        yield "\n\n"
+
+        try:
+            data = await run_audit(question, primary_answer, cerebras_perspective)
+        except Exception:
+            logger.exception("audit failed")
+            yield "AUDIT FAILURE: the auditor did not return a usable report."
+            return
+        yield format_audit_sections(data)
+
+    return StreamingResponse(generate(), media_type="text/plain")
+
+@app.get("/healthz")
+async def healthz():
+    cached = sum(c for c, _ in _prompt_cache_samples)
+    prompt = sum(p for _, p in _prompt_cache_samples)
+    return {
+        "status": "ok",
+        "prompt_cache_hit_ratio": round(cached / prompt, 3) if prompt else 0.0,
+    }
+
+# Offline path: the OpenAI Batch API runs the same audits at half the input-token
+# price with a 24h window — for nightly re-audits and bulk scans, not the UI.
+@app.post("/audit/batch")
+async def submit_batch(request: BatchAuditRequest):
+    if not openai_client:
+        raise HTTPException(status_code=503, detail="OpenAI client not configured")
+    questions = [q.strip() for q in request.questions if q.strip()]
+    if not questions:
+        raise HTTPException(status_code=400, detail="No questions supplied")
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"Too many questions (max {MAX_BATCH_QUESTIONS})")
+    # Same boundary /audit and /audit/stream enforce — offline must not be a
+    # loophole for oversize (and oversize-billed) questions
+    if any(len(q) > MAX_INPUT_CHARS for q in questions):
+        raise HTTPException(status_code=413, detail="Input too large")
+
+    lines = []
+    for i, question in enumerate(questions):
+        lines.append(orjson.dumps({
+            "custom_id": f"q-{i}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": OPENAI_MODEL,
+                "messages": [
+                    {"role": "system", "content": COMBINED_AUDIT_PROMPT},
+                    {"role": "user", "content": AUDIT_INPUT_TMPL % (question, "N/A", "N/A")},
+                ],
+                "response_format": {"type": "json_object"},
+                "max_tokens": MAX_AUDIT_TOKENS,
+                "temperature": 0,
+            },
+        }))
+
+    batch_file = await openai_client.files.create(
+        file=("audits.jsonl", b"\n".join(lines)),
+        purpose="batch",
+    )
+    batch = await openai_client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    return {"batch_id": batch.id, "status": batch.status}
+
+@app.get("/audit/batch/{batch_id}")
+async def poll_batch(batch_id: str):
+    if not openai_client:
+        raise HTTPException(status_code=503, detail="OpenAI client not configured")
+    batch = await openai_client.batches.retrieve(batch_id)
+    if batch.status != "completed":
+        return {"batch_id": batch.id, "status": batch.status}
+
+    # output_file_id is None when every request in the batch failed
+    if not batch.output_file_id:
+        return {"batch_id": batch.id, "status": batch.status, "reports": {},
+                "errors": {"batch": "no output file — all requests failed"}}
+
+    output = await openai_client.files.content(batch.output_file_id)
+    reports = {}
+    errors = {}
+    for line in output.text.splitlines():
+        if not line.strip():
+            continue
+        entry = orjson.loads(line)
+        custom_id = entry.get("custom_id", "unknown")
+        # One failed or refused entry must not hide the completed reports:
+        # entry["response"] can be null or carry a non-200 body without
+        # choices, and the content can be non-JSON on refusals
+        try:
+            data = parse_audit_json(entry["response"]["body"]["choices"][0]["message"]["content"])
+            answer = data.pop("answer", None) or "N/A"
+            reports[custom_id] = f"ANSWER BY AI\n{answer}\n\n" + format_audit_sections(data)
+        except (KeyError, TypeError, IndexError, ValueError) as e:
+            upstream = entry.get("error")
+            detail = upstream.get("message") if isinstance(upstream, dict) else None
+            errors[custom_id] = detail or f"unusable batch result: {e}"
+            logger.warning("batch entry %s failed: %s", custom_id, errors[custom_id])
+    return {"batch_id": batch.id, "status": batch.status, "reports": reports, "errors": errors}
\ No newline at end of file